@@ -1,15 +1,23 @@
 import os
+import re
+import sys
 import logging
+import asyncio
+import time
+from contextlib import asynccontextmanager
 from decimal import Decimal, InvalidOperation
+from typing import Annotated, NamedTuple
 from urllib.parse import urlencode
-import csv
-from io import StringIO
+from xml.sax.saxutils import escape, quoteattr
+import operator
+from io import BytesIO
 
 import httpx
-import xml.etree.ElementTree as ET
+from lxml import etree as ET
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Query, Request
-from fastapi.responses import Response, JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response, ORJSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 
@@ -22,6 +30,14 @@ load_dotenv()
 STORE_FEED_URL = os.getenv("STORE_FEED_URL")
 SUPPLIER_FEED_URL = os.getenv("SUPPLIER_FEED_URL")
 API_TOKEN = os.getenv("API_TOKEN", "change-me")
+# Birleşik feed'in bellekte tutulacağı süre (saniye)
+MERGE_CACHE_TTL = float(os.getenv("MERGE_CACHE_TTL", "60"))
+# Cache'te aynı anda tutulacak en fazla birleşik feed sayısı (override URL'ler her çift için ayrı kayıt açar)
+MERGE_CACHE_MAX_ENTRIES = int(os.getenv("MERGE_CACHE_MAX_ENTRIES", "16"))
+# Deneysel: mağaza XML'ini ağaç kurmadan, ürün ürün akış halinde yeniden yaz
+STREAMING_XML_MERGE = os.getenv("STREAMING_XML_MERGE", "false").strip().lower() in {"1", "true", "yes"}
+# Deneysel: düz yapılı tedarikçi feed'ini XML parser yerine regex ile tara
+SUPPLIER_REGEX_SCAN = os.getenv("SUPPLIER_REGEX_SCAN", "false").strip().lower() in {"1", "true", "yes"}
 
 if not STORE_FEED_URL or not SUPPLIER_FEED_URL:
     raise RuntimeError("STORE_FEED_URL ve SUPPLIER_FEED_URL environment değişkenlerini tanımlamalısın.")
@@ -29,6 +45,22 @@ if not STORE_FEED_URL or not SUPPLIER_FEED_URL:
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Feed istekleri için tek bir HTTP client paylaşılır: bağlantılar havuzda
+    tutulur, aynı host'a giden istekler TCP/TLS handshake'ini tekrarlamaz.
+    """
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(10.0, connect=5.0),
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+    )
+    yield
+    await app.state.http.aclose()
+
+
 app = FastAPI(
     title="XML Ürün Birleştirme Servisi",
     description=(
@@ -36,8 +68,14 @@ app = FastAPI(
         "stokları toplar ve tek bir XML feed olarak sunar."
     ),
     version="1.0.0",
+    # dict dönen endpoint'ler (/, /health) orjson ile serialize edilsin
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
+# Birleşik XML / CSV çıktıları çok iyi sıkışıyor; istemci destekliyorsa gzip'le gönder
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 templates = Jinja2Templates(directory="templates")
 
 # İstersen ileride CSS/JS koyarsın diye static klasörünü de mount edelim
@@ -84,18 +122,44 @@ def build_override_query_suffix(store_override: str | None, supplier_override: s
     return "&" + urlencode(params)
 
 
-def parse_decimal(text: str) -> Decimal:
-    """Stok alanlarını güvenli şekilde Decimal'e çevir. Boş veya hatalıysa 0 kabul edilir."""
+def parse_decimal(text: str) -> int | Decimal:
+    """
+    Stok alanlarını güvenli şekilde sayıya çevir. Boş veya hatalıysa 0 kabul edilir.
+
+    Stoklar neredeyse her zaman tam sayı olduğu için düz rakamlar int döner,
+    Decimal'e sadece ondalık/işaretli değerlerde düşülür.
+    """
     if text is None:
-        return Decimal(0)
+        return 0
     text = text.strip()
     if not text:
-        return Decimal(0)
+        return 0
+    if text.isascii() and text.isdigit():
+        return int(text)
     try:
         return Decimal(text.replace(",", "."))
     except (InvalidOperation, ValueError):
         logger.warning("Sayısal olmayan stok değeri tespit edildi: %r -> 0 kabul ediliyor", text)
-        return Decimal(0)
+        return 0
+
+
+def is_integral(value: Decimal) -> bool:
+    """Decimal tam sayı mı? Üs >= 0 ise (örn. '12') yeni Decimal üretmeden karar verilir."""
+    return value.as_tuple().exponent >= 0 or value == value.to_integral_value()
+
+
+def format_stok(value: int | Decimal) -> str:
+    """XML'e yazılacak stok metni: tam sayıysa integer, değilse decimal string."""
+    if isinstance(value, int):
+        return str(value)
+    return str(int(value)) if is_integral(value) else format(value, "f")
+
+
+def stok_for_row(value: int | Decimal) -> int | float:
+    """UI / CSV satırı için stoğu int'e (tam sayıysa) veya float'a çevir."""
+    if isinstance(value, int):
+        return value
+    return int(value) if is_integral(value) else float(value)
 
 
 def load_products(xml_bytes: bytes, key_field: str):
@@ -116,7 +180,11 @@ def load_products(xml_bytes: bytes, key_field: str):
     </urunler>
     """
     try:
-        root = ET.fromstring(xml_bytes)
+        # Feed'ler dışarıdan geliyor; sadece belge içinde tanımlı entity'ler çözülür,
+        # dış (SYSTEM / PUBLIC) entity'ler parse hatası verir (XXE'ye karşı).
+        # Parser her çağrıda oluşturulur: merge thread pool'da çalışıyor ve
+        # paylaşılan bir lxml parser'ı thread'ler arasında kilitlenir.
+        root = ET.fromstring(xml_bytes, ET.XMLParser(resolve_entities="internal"))
     except ET.ParseError as e:
         logger.error("XML parse hatası: %s", e)
         raise ValueError("Geçersiz XML formatı")
@@ -127,28 +195,274 @@ def load_products(xml_bytes: bytes, key_field: str):
     products = {}
 
     for urun in root.findall("urun"):
-        key_el = urun.find(key_field)
-        if key_el is None or key_el.text is None or not key_el.text.strip():
+        entry = _read_urun(urun, key_field)
+        if entry is None:
             # Anahtar alanı olmayan ürünü atlıyoruz (barkodsuz ürün)
             continue
 
-        key = key_el.text.strip()
+        key, sdata = entry
+        products[key] = sdata
 
-        stok_el = urun.find("stok")
-        stok = parse_decimal(stok_el.text if stok_el is not None else None)
+    return root, products
 
-        products[key] = {
-            "urun": urun,  # XML node'un kendisi
-            "stok": stok,
-        }
 
-    return root, products
+def _read_urun(urun, key_field: str):
+    """
+    <urun>'un alt elemanlarını tek geçişte okur (her alan için ayrı find() yerine).
+
+    Dönen: (key, (urun, stok, stok_el, barkod_el, urun_adi_el)),
+    anahtar alanı boşsa None.
+    """
+    key_el = stok_el = barkod_el = urun_adi_el = None
+    for child in urun:
+        tag = child.tag
+        if tag == key_field and key_el is None:
+            key_el = child
+        if tag == "stok":
+            if stok_el is None:
+                stok_el = child
+        elif tag == "barkod":
+            if barkod_el is None:
+                barkod_el = child
+        elif tag == "urunAdi":
+            if urun_adi_el is None:
+                urun_adi_el = child
+
+    if key_el is None or key_el.text is None or not key_el.text.strip():
+        return None
+
+    # Aynı key'ler mağaza / tedarikçi map'lerinde aynı nesneyi paylaşsın (intern)
+    key = sys.intern(key_el.text.strip())
+    stok = parse_decimal(stok_el.text if stok_el is not None else None)
+
+    # merge döngüsü tekrar find() yapmasın diye elemanlar da taşınır
+    return key, (urun, stok, stok_el, barkod_el, urun_adi_el)
+
+
+# Regex taraması için: root <urunler> olmalı, encoding (belirtilmişse) UTF-8 olmalı
+# ve root'un ilk çocuğu <urun> olmalı (ya da root boş olmalı)
+_SUPPLIER_HEAD_RE = re.compile(
+    rb"""\A(?:\xef\xbb\xbf)?\s*(?:<\?xml\b(?:[^?]*?\bencoding\s*=\s*["'](?P<enc>[^"']+)["'])?[^?]*\?>\s*)?"""
+    rb"""<urunler(?=[\s/>])[^>]*?(?:/>|>(?:\s|<!--.*?-->)*(?:<urun[\s/>]|</urunler\s*>))""",
+    re.DOTALL,
+)
+# Tek geçişte alanları, ürün sonlarını (</urun>) ve yorum / CDATA bölümlerini yakalar:
+# - field / value: düz metinli (ya da kendiliğinden kapanan) anahtar veya <stok> alanı
+# - markup: değeri düz metin olmayan alan (CDATA, yorum, alt eleman) -> parser'a bırakılır
+# - urun_end / next: </urun>'dan sonra sadece yeni bir <urun> ya da </urunler> gelmeli;
+#   gelmiyorsa ürünler root'un doğrudan çocuğu değildir (örn. <grup> içinde)
+# - yorum / CDATA bölümleri bütün olarak tüketilir, içlerindeki tag'ler eşleşmez
+# Kapanış tag'lerinde '>' öncesi boşluk geçerlidir.
+_SUPPLIER_SCAN_RES = {
+    key_field: re.compile(
+        rb"<(?:"
+        rb"(?P<field>%(fields)s)(?:(?:\s[^>]*)?(?:/>|>(?P<value>[^<]*)</(?P=field)\s*>)|(?=[\s/>])(?P<markup>))"
+        rb"|(?P<urun_end>/urun\s*>)(?=(?:\s|<!--.*?-->)*(?P<next><urun[\s/>]|</urunler\s*>))?"
+        rb"|!--[^-]*(?:-(?!->)[^-]*)*-->"
+        rb"|!\[CDATA\[[^\]]*(?:\](?!\]>)[^\]]*)*\]\]>"
+        rb")" % {b"fields": key_field.encode("ascii") + b"|stok"},
+        re.DOTALL,
+    )
+    for key_field in ("barkod", "stokKodu")
+}
+# XML'in tanıdığı entity'ler: 5 önceden tanımlı entity + sayısal karakter referansları.
+# Son alternatif başka her '&'i (örn. HTML'e özgü &nbsp;) yakalar.
+_XML_ENTITY_RE = re.compile(r"&(?:#([0-9]+);|#x([0-9a-fA-F]+);|(lt|gt|amp|quot|apos);)|&")
+_XML_ENTITIES = {"lt": "<", "gt": ">", "amp": "&", "quot": '"', "apos": "'"}
+
+
+def _xml_entity(match: re.Match) -> str:
+    """_XML_ENTITY_RE eşleşmesini karşılık gelen karaktere çevirir."""
+    dec, hex_, name = match.groups()
+    if name is not None:
+        return _XML_ENTITIES[name]
+    if dec is None and hex_ is None:
+        raise ValueError("XML'de tanımlı olmayan entity")
+    code = int(dec) if dec is not None else int(hex_, 16)
+    # XML 1.0 Char aralığı dışındaki referansları parser da reddeder
+    if not (
+        code in (0x9, 0xA, 0xD)
+        or 0x20 <= code <= 0xD7FF
+        or 0xE000 <= code <= 0xFFFD
+        or 0x10000 <= code <= 0x10FFFF
+    ):
+        raise ValueError("Geçersiz karakter referansı")
+    return chr(code)
+
+
+def _xml_unescape(text: bytes) -> str:
+    """Metni XML parser'ın yaptığı gibi çözer; XML'de geçersiz entity'de ValueError."""
+    value = text.decode("utf-8")
+    return _XML_ENTITY_RE.sub(_xml_entity, value) if "&" in value else value
+
+
+def _scan_supplier_stocks(xml_bytes: bytes, key_field: str) -> dict[str, str | None] | None:
+    """
+    load_supplier_stocks'un XML parser kullanmayan hızlı yolu (SUPPLIER_REGEX_SCAN).
+
+    Tüm byte'lar tek bir derlenmiş regex ile bir kez taranır; her ürün için
+    key_field ve <stok>'un ilk geçtiği değer </urun> görülünce kaydedilir. Sadece
+    düz yapılı feed'ler için güvenilirdir ve XML'in geçerliliği kontrol edilmez.
+    Yorum ve CDATA bölümlerinin içi taranmaz. Sessizce yanlış stok üretmek yerine
+    şu durumlarda None döner ve normal parser kullanılır: başlık beklenen gibi
+    değil (root <urunler> değil, UTF-8 dışı encoding), anahtar / stok değeri düz
+    metin değil (CDATA, yorum, alt eleman), ürünler root'un doğrudan çocuğu değil
+    ya da bir değer XML'de tanımlı olmayan bir entity içeriyor.
+    """
+    head = _SUPPLIER_HEAD_RE.match(xml_bytes)
+    if head is None:
+        return None
+    encoding = head.group("enc")
+    if encoding is not None and encoding.lower() not in {b"utf-8", b"utf8"}:
+        return None
+
+    key_tag = key_field.encode("ascii")
+    stocks = {}
+    key = stok = None
+
+    try:
+        for match in _SUPPLIER_SCAN_RES[key_field].finditer(xml_bytes):
+            field, value, markup, urun_end, next_tag = match.groups()
+            if markup is not None:
+                return None
+            if field is not None:
+                if value is None:
+                    value = b""  # Kendiliğinden kapanan alan (<stok/>)
+                if field == key_tag:
+                    if key is None:
+                        key = value
+                elif stok is None:
+                    stok = value
+            elif urun_end is not None:
+                # </urun>: ürün tamamlandı
+                if next_tag is None:
+                    return None
+                if key is not None:
+                    key = sys.intern(_xml_unescape(key).strip())
+                    if key:
+                        stocks[key] = _xml_unescape(stok) if stok is not None else None
+                key = stok = None
+            # Geriye kalan eşleşmeler yorum / CDATA bölümleri: atlanır
+    except ValueError:
+        # Geçersiz entity / UTF-8: hatayı parser raporlasın
+        return None
+
+    return stocks
+
+
+def load_supplier_stocks(xml_bytes: bytes, key_field: str) -> dict[str, str | None]:
+    """
+    Tedarikçi XML'inden sadece {key: ham stok metni} map'ini çıkarır.
+
+    Tedarikçi ağacına sonradan ihtiyaç olmadığı için XML iterparse ile akış
+    halinde okunur ve her <urun> işlendikten sonra bellekten atılır.
+    """
+    if SUPPLIER_REGEX_SCAN:
+        stocks = _scan_supplier_stocks(xml_bytes, key_field)
+        if stocks is not None:
+            return stocks
+
+    context = ET.iterparse(BytesIO(xml_bytes), events=("end",), tag="urun", resolve_entities="internal")
+    stocks = {}
+
+    # Sadece metin lazım: findtext Element nesnesi döndürmez, erişimciler bir kez bağlanır
+    find_key = operator.methodcaller("findtext", key_field)
+    find_stok = operator.methodcaller("findtext", "stok")
+
+    try:
+        for _, urun in context:
+            # tag="urun" her derinlikte eşleşir; mağaza tarafındaki gibi sadece root'un
+            # doğrudan çocukları sayılır (örn. <grup> içindeki <urun>'lar atlanır).
+            # İç içe olanlar temizlenmez: üst elemanları root seviyesinde silinir.
+            parent = urun.getparent()
+            if parent is None or parent.getparent() is not None:
+                continue
+
+            key = find_key(urun)
+            if key is not None and key.strip():
+                # Ham metin tutulur; sadece mağazada eşleşen ürünler parse edilir
+                stocks[sys.intern(key.strip())] = find_stok(urun)
+
+            # İşlenen ürünü ve önceki kardeşlerini bellekten at
+            urun.clear()
+            while urun.getprevious() is not None:
+                del urun.getparent()[0]
+    except ET.ParseError as e:
+        logger.error("XML parse hatası: %s", e)
+        raise ValueError("Geçersiz XML formatı")
+
+    if context.root is None or context.root.tag != "urunler":
+        raise ValueError("Root elemanı 'urunler' olmalı")
+
+    return stocks
+
+
+def _load_feeds(store_xml: bytes, supplier_xml: bytes, key_field: str):
+    """Mağaza ağacını ve tedarikçi stok map'ini yükler (compute_merged / iter_merged_rows ortak kısmı)."""
+    if key_field not in {"barkod", "stokKodu"}:
+        raise ValueError("key_field sadece 'barkod' veya 'stokKodu' olabilir")
+
+    store_root, store_products = load_products(store_xml, key_field)
+    supplier_stocks = load_supplier_stocks(supplier_xml, key_field)
+
+    logger.info("Mağaza ürün sayısı: %d", len(store_products))
+    logger.info("Tedarikçi ürün sayısı: %d", len(supplier_stocks))
+
+    return store_root, store_products, supplier_stocks
+
+
+class MergedRow(NamedTuple):
+    """UI / CSV için ürün bazlı özet satırı."""
+
+    key: str
+    barkod: str
+    urunAdi: str
+    stok_magaza: int | float
+    stok_tedarikci: int | float
+    stok_toplam: int | float
+
+
+def _merge_product(key: str, sdata: tuple, supplier_stocks: dict) -> MergedRow:
+    """Tek ürünün <stok> elemanını toplam stok ile günceller, özet satırını döner."""
+    urun_node, stok_magaza, stok_el, barkod_el, urun_adi_el = sdata
+
+    stok_tedarikci = parse_decimal(supplier_stocks.get(key))
+
+    stok_toplam = stok_magaza + stok_tedarikci
+
+    if stok_toplam < 0:
+        logger.warning("Negatif stok hesaplandı (%s), 0'a çekiliyor", stok_toplam)
+        stok_toplam = 0
+
+    # Mağaza XML'indeki <stok> elementini toplam stok ile güncelle
+    if stok_el is None:
+        stok_el = ET.SubElement(urun_node, "stok")
+
+    stok_el.text = format_stok(stok_toplam)
+
+    return MergedRow(
+        key,
+        barkod_el.text.strip() if barkod_el is not None and barkod_el.text else "",
+        urun_adi_el.text.strip() if urun_adi_el is not None and urun_adi_el.text else "",
+        stok_for_row(stok_magaza),
+        stok_for_row(stok_tedarikci),
+        stok_for_row(stok_toplam),
+    )
+
+
+def _merge_products(store_products: dict, supplier_stocks: dict):
+    """
+    Mağaza ürünlerinin <stok> elemanlarını toplam stok ile günceller ve
+    her ürün için bir MergedRow üretir.
+    """
+    for key, sdata in store_products.items():
+        yield _merge_product(key, sdata, supplier_stocks)
 
 
 def compute_merged(store_xml: bytes, supplier_xml: bytes, key_field: str = "barkod"):
     """
     İki XML feed'ini birleştirir ve hem birleşmiş XML'i hem de
-    UI için ürün bazlı özet bilgileri döner.
+    UI / CSV için ürün bazlı özet satırlarını (MergedRow listesi) döner.
 
     - Mağaza XML'i (store_xml) referans alınır:
       * Ürün listesi buradan gelir.
@@ -157,71 +471,302 @@ def compute_merged(store_xml: bytes, supplier_xml: bytes, key_field: str = "bark
     - Eşleştirme default 'barkod' üzerinden yapılır.
     - Çıkan XML: mağaza XML'inin birebir yapısı, sadece <stok> toplam stok ile güncellenmiş olur.
     """
+    if STREAMING_XML_MERGE:
+        return compute_merged_streaming(store_xml, supplier_xml, key_field)
+
+    store_root, store_products, supplier_stocks = _load_feeds(store_xml, supplier_xml, key_field)
+    return _merge_tree(store_root, store_products, supplier_stocks)
+
+
+def _merge_tree(store_root, store_products: dict, supplier_stocks: dict):
+    """Mağaza ağacını günceller; (birleşmiş XML, MergedRow listesi) döner."""
+    # UI / CSV için
+    merged_rows = list(_merge_products(store_products, supplier_stocks))
+
+    # lxml'in C serializer'ı; mağaza XML'indeki boşluklar olduğu gibi korunur
+    merged_xml_bytes = ET.tostring(store_root, encoding="utf-8", xml_declaration=True, pretty_print=False)
+    return merged_xml_bytes, merged_rows
+
+
+# compute_merged_streaming: <stok>'un serialize edilmiş üründeki yerini bulmak için geçici metin
+_STOK_PLACEHOLDER = "\ue000stok\ue001"
+_STOK_PLACEHOLDER_BYTES = _STOK_PLACEHOLDER.encode("utf-8")
+
+
+class _StreamingFallback(Exception):
+    """Akış halinde birebir aynı çıktı üretilemiyor; compute_merged_streaming ağaç versiyonuna düşer."""
+
+
+def _escape_text(text: str | None) -> bytes:
+    """Metni lxml'in serializer'ı gibi escape eder (satır başı karakteri dahil)."""
+    if not text:
+        return b""
+    # Tail'lerin çoğu sadece boşluk, stok değerleri sayı: escape'e nadiren gerek olur
+    if "&" in text or "<" in text or ">" in text or "\r" in text:
+        text = escape(text, {"\r": "&#13;"})
+    return text.encode("utf-8")
+
+
+def _serialize_root_child(node, ns_decls: tuple[bytes, ...]) -> bytes:
+    """Root'un bir çocuğunu tail'siz serialize eder; root'tan gelen xmlns tanımlarını çıkarır."""
+    chunk = ET.tostring(node, encoding="utf-8", with_tail=False)
+    if ns_decls:
+        tag_end = chunk.index(b">")
+        start_tag = chunk[:tag_end]
+        for decl in ns_decls:
+            start_tag = start_tag.replace(decl, b"", 1)
+        chunk = start_tag + chunk[tag_end:]
+    return chunk
+
+
+def _serialize_merged_urun(key: str, sdata: tuple, supplier_stocks: dict, ns_decls: tuple[bytes, ...]):
+    """
+    Ürünü merge eder ve <stok>'un etrafından bölünmüş olarak serialize eder.
+
+    Dönen: (row, önce, güncel <stok>, orijinal <stok> bilgisi, sonra). Aynı key'li
+    bir ürün daha gelirse çıktıda orijinal <stok> kullanılır (bkz. _original_stok).
+    <stok>'un yeri kesin bulunamazsa _StreamingFallback fırlatılır.
+    """
+    urun_node, stok_el = sdata[0], sdata[2]
+
+    if stok_el is None:
+        # _merge_product ürünün sonuna yeni bir <stok> ekler; orijinalde hiç yoktur
+        original = _serialize_root_child(urun_node, ns_decls)
+        row = _merge_product(key, sdata, supplier_stocks)
+        merged = _serialize_root_child(urun_node, ns_decls)
+        split = original.rindex(b"</")
+        return row, original[:split], merged[split : len(merged) - len(original) + split], None, original[split:]
+
+    original_text = stok_el.text
+    row = _merge_product(key, sdata, supplier_stocks)
+    merged_text = stok_el.text
+
+    stok_el.text = _STOK_PLACEHOLDER
+    chunk = _serialize_root_child(urun_node, ns_decls)
+    # Placeholder'dan sonrası <stok>'un çocukları (yorumlar dahil) + </stok>;
+    # çocuk varsa <stok> tek başına serialize edilerek bulunur
+    if len(stok_el):
+        stok_bytes = ET.tostring(stok_el, encoding="utf-8", with_tail=False)
+        inner = stok_bytes[stok_bytes.index(_STOK_PLACEHOLDER_BYTES) + len(_STOK_PLACEHOLDER_BYTES) :]
+    else:
+        inner = b"</stok>"
+
+    # Placeholder başka bir alanda da geçiyorsa yer belirsizdir
+    if chunk.count(_STOK_PLACEHOLDER_BYTES) != 1:
+        raise _StreamingFallback
+    before, after = chunk.split(_STOK_PLACEHOLDER_BYTES)
+    if not after.startswith(inner):
+        raise _StreamingFallback
+    # before "<stok ...>" ile biter (attribute değerlerinde '<' escape edilir)
+    tag_start = before.rindex(b"<")
+    before, start_tag = before[:tag_start], before[tag_start:]
+    after = after[len(inner) :]
+
+    merged_stok = start_tag + _escape_text(merged_text) + inner
+    return row, before, merged_stok, (start_tag, original_text, inner), after
+
+
+def _original_stok(original) -> bytes:
+    """_serialize_merged_urun'un döndüğü orijinal <stok> bilgisini serialize eder."""
+    if original is None:
+        return b""  # Üründe <stok> yoktu
+    start_tag, text, inner = original
+    # Metni ve çocuğu olmayan eleman lxml'de kendiliğinden kapanan tag olarak yazılır
+    if not text and inner == b"</stok>":
+        return start_tag[:-1] + b"/>"
+    return start_tag + _escape_text(text) + inner
+
+
+def compute_merged_streaming(store_xml: bytes, supplier_xml: bytes, key_field: str = "barkod"):
+    """
+    compute_merged'in mağaza ağacını bellekte kurmayan versiyonu (STREAMING_XML_MERGE).
+
+    Mağaza XML'i iterparse ile okunur; root'un her çocuğu tamamlandığında
+    (gerekirse <stok>'u güncellenip) serialize edilir ve ağaçtan silinir.
+    Bellekte tüm ağaç yerine sadece o anki ürün ve çıktı byte'ları durur.
+
+    Çıktı ağaç versiyonuyla aynıdır: root seviyesindeki yorum / processing
+    instruction'lar belge sırasıyla yazılır; aynı key'e sahip birden fazla ürün
+    varsa sadece sonuncusu güncellenir, özet satırı ilk görüldüğü sırada kalır.
+    Bunun akış halinde garanti edilemediği nadir feed'lerde (root'un namespace
+    tanımını tekrarlayan eleman, placeholder metnini içeren ürün) ağaç
+    versiyonuna düşülür.
+    """
     if key_field not in {"barkod", "stokKodu"}:
         raise ValueError("key_field sadece 'barkod' veya 'stokKodu' olabilir")
 
-    store_root, store_products = load_products(store_xml, key_field)
-    _, supplier_products = load_products(supplier_xml, key_field)
+    supplier_stocks = load_supplier_stocks(supplier_xml, key_field)
 
-    logger.info("Mağaza ürün sayısı: %d", len(store_products))
-    logger.info("Tedarikçi ürün sayısı: %d", len(supplier_products))
+    context = ET.iterparse(BytesIO(store_xml), events=("start-ns", "end"), resolve_entities="internal")
+    chunks = []
+    merged_rows = []
+    seen = {}  # key -> (merged_rows index, chunks'taki <stok> index'i, orijinal <stok>)
+    root = None
+    root_ns = None
+    declared_ns = []  # Root bulunana kadar görülen namespace tanımları
+    ns_decls = ()
+    pending = None  # Son yazılan çocuk; tail'i bir sonraki eleman gelince belli olur
 
-    merged_rows = []  # UI tablosu için
+    try:
+        for event, el in context:
+            if event == "start-ns":
+                # Root'un bir tanımını tekrarlayan elemanda bu tanım, serialize sırasında
+                # root'tan kopyalanandan ayırt edilemez (bkz. _serialize_root_child)
+                ns = (el[0] or None, el[1])
+                if root_ns is None:
+                    declared_ns.append(ns)
+                elif ns in root_ns:
+                    raise _StreamingFallback
+                continue
+
+            if root is None:
+                root = el
+                while root.getparent() is not None:
+                    root = root.getparent()
+                if root.tag != "urunler":
+                    raise ValueError("Root elemanı 'urunler' olmalı")
+                # Alt ağaç serialize edilirken lxml root'un namespace'lerini her ürüne
+                # tekrar yazar; bunları ürünün başlangıç tag'inden çıkarmak için
+                ns_decls = tuple(
+                    (f" xmlns:{prefix}=" if prefix else " xmlns=").encode("utf-8")
+                    + quoteattr(uri).encode("utf-8")
+                    for prefix, uri in root.nsmap.items()
+                )
+                root_ns = set(root.nsmap.items())
+                if sum(ns in root_ns for ns in declared_ns) > len(root_ns):
+                    raise _StreamingFallback
+
+            if el.getparent() is not root:
+                continue
+
+            if pending is not None:
+                chunks.append(_escape_text(pending.tail))
+                root.remove(pending)
+
+            # Root seviyesindeki yorum / PI'lar iterparse'ta event üretmez; elemandan önce gelenler burada yazılır
+            if el.getprevious() is not None:
+                for node in reversed(list(el.itersiblings(preceding=True))):
+                    chunks.append(ET.tostring(node, encoding="utf-8"))
+                    root.remove(node)
+
+            entry = _read_urun(el, key_field) if el.tag == "urun" else None
+            if entry is None:
+                chunks.append(_serialize_root_child(el, ns_decls))
+            else:
+                key, sdata = entry
+                row, before, merged_stok, original_stok, after = _serialize_merged_urun(
+                    key, sdata, supplier_stocks, ns_decls
+                )
+                previous = seen.get(key)
+                if previous is None:
+                    row_index = len(merged_rows)
+                    merged_rows.append(row)
+                else:
+                    # Ağaç versiyonundaki gibi sadece son ürün güncellenir: öncekini geri al
+                    row_index, stok_index, previous_stok = previous
+                    chunks[stok_index] = _original_stok(previous_stok)
+                    merged_rows[row_index] = row
+                chunks.append(before)
+                seen[key] = (row_index, len(chunks), original_stok)
+                chunks.append(merged_stok)
+                chunks.append(after)
+
+            el.clear(keep_tail=True)
+            pending = el
+    except ET.ParseError as e:
+        logger.error("XML parse hatası: %s", e)
+        raise ValueError("Geçersiz XML formatı")
+    except _StreamingFallback:
+        logger.info("Mağaza XML'i akış halinde birebir yazılamıyor, ağaç üzerinden birleştiriliyor")
+        store_root, store_products = load_products(store_xml, key_field)
+        logger.info("Mağaza ürün sayısı: %d", len(store_products))
+        logger.info("Tedarikçi ürün sayısı: %d", len(supplier_stocks))
+        return _merge_tree(store_root, store_products, supplier_stocks)
+
+    if root is None:
+        raise ValueError("Geçersiz XML formatı")
 
-    for key, sdata in store_products.items():
-        urun_node = sdata["urun"]
-        stok_magaza = sdata["stok"]
+    if pending is not None:
+        chunks.append(_escape_text(pending.tail))
+        root.remove(pending)
+
+    # Son elemandan sonraki yorum / PI'lar
+    for node in list(root):
+        chunks.append(ET.tostring(node, encoding="utf-8"))
+        root.remove(node)
+
+    # Çocukları silinmiş root: başlangıç tag'i + ilk çocuktan önceki metin + kapanış tag'i
+    root_bytes = ET.tostring(root, encoding="utf-8")
+    if not chunks:
+        head, tail = root_bytes, b""
+    elif root_bytes.endswith(b"/>"):
+        head, tail = root_bytes[:-2] + b">", b"</urunler>"
+    else:
+        head, tail = root_bytes[: -len(b"</urunler>")], b"</urunler>"
 
-        if key in supplier_products:
-            stok_tedarikci = supplier_products[key]["stok"]
-        else:
-            stok_tedarikci = Decimal(0)
+    logger.info("Mağaza ürün sayısı: %d", len(merged_rows))
+    logger.info("Tedarikçi ürün sayısı: %d", len(supplier_stocks))
 
-        stok_toplam = stok_magaza + stok_tedarikci
+    merged_xml_bytes = b"".join([b"<?xml version='1.0' encoding='utf-8'?>\n", head, *chunks, tail])
+    return merged_xml_bytes, merged_rows
 
-        if stok_toplam < 0:
-            logger.warning("Negatif stok hesaplandı (%s), 0'a çekiliyor", stok_toplam)
-            stok_toplam = Decimal(0)
 
-        # Mağaza XML'indeki <stok> elementini toplam stok ile güncelle
-        stok_el = urun_node.find("stok")
-        if stok_el is None:
-            stok_el = ET.SubElement(urun_node, "stok")
+def iter_merged_rows(store_xml: bytes, supplier_xml: bytes, key_field: str = "barkod"):
+    """
+    compute_merged'in XML üretmeyen, satırları liste yerine generator olarak
+    dönen versiyonu (CSV akışı için). Satırlar MergedRow'dur.
 
-        # Tam sayı ise integer yaz, yoksa decimal string
-        if stok_toplam == stok_toplam.to_integral_value():
-            stok_el.text = str(int(stok_toplam))
-        else:
-            stok_el.text = format(stok_toplam, "f")
-
-        # UI özet satırı
-        barkod_el = urun_node.find("barkod")
-        urun_adi_el = urun_node.find("urunAdi")
-
-        merged_rows.append(
-            {
-                "key": key,
-                "barkod": barkod_el.text.strip() if barkod_el is not None and barkod_el.text else "",
-                "urunAdi": urun_adi_el.text.strip() if urun_adi_el is not None and urun_adi_el.text else "",
-                "stok_magaza": int(stok_magaza) if stok_magaza == stok_magaza.to_integral_value() else float(stok_magaza),
-                "stok_tedarikci": int(stok_tedarikci) if stok_tedarikci == stok_tedarikci.to_integral_value() else float(stok_tedarikci),
-                "stok_toplam": int(stok_toplam) if stok_toplam == stok_toplam.to_integral_value() else float(stok_toplam),
-            }
-        )
+    Parse / doğrulama hataları generator tüketilmeden, çağrı anında fırlatılır.
+    """
+    _, store_products, supplier_stocks = _load_feeds(store_xml, supplier_xml, key_field)
+    return _merge_products(store_products, supplier_stocks)
 
-    merged_xml_bytes = ET.tostring(store_root, encoding="utf-8", xml_declaration=True)
-    return merged_xml_bytes, merged_rows
 
+CSV_HEADER = ["Barkod", "Key", "Ürün Adı", "Mağaza Stok", "Tedarikçi Stok", "Toplam Stok"]
+CSV_HEADER_BYTES = ("\ufeff" + ",".join(CSV_HEADER) + "\r\n").encode("utf-8")  # Excel için BOM
+CSV_FLUSH_ROWS = 500
 
-async def fetch_xml(url: str) -> bytes:
-    """Verilen URL'den XML içeriğini çeker."""
-    timeout = httpx.Timeout(10.0, connect=5.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        try:
-            resp = await client.get(url)
-        except httpx.RequestError as e:
-            logger.error("XML feed isteği başarısız: %s -> %s", url, e)
-            raise HTTPException(status_code=502, detail=f"Upstream feed erişilemedi: {url}")
+
+def _csv_quote(value: str) -> str:
+    """Alanı sadece gerekiyorsa (virgül, tırnak, satır sonu içeriyorsa) CSV için tırnakla."""
+    if "," in value or '"' in value or "\n" in value or "\r" in value:
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def _format_csv_row(r: MergedRow) -> bytes:
+    """MergedRow'u CSV satırı olarak encode eder (csv.writer QUOTE_MINIMAL çıktısıyla aynı)."""
+    return (
+        f"{_csv_quote(r.barkod)},{_csv_quote(r.key)},{_csv_quote(r.urunAdi)},"
+        f"{r.stok_magaza},{r.stok_tedarikci},{r.stok_toplam}\r\n"
+    ).encode("utf-8")
+
+
+def csv_stream_generator(rows):
+    """
+    MergedRow satırlarını CSV byte parçaları olarak üretir.
+    Tüm CSV bellekte biriktirilmez; her CSV_FLUSH_ROWS satırda bir parça gönderilir.
+    """
+    yield CSV_HEADER_BYTES
+
+    chunk = []
+    for r in rows:
+        chunk.append(_format_csv_row(r))
+        if len(chunk) == CSV_FLUSH_ROWS:
+            yield b"".join(chunk)
+            chunk.clear()
+
+    if chunk:
+        yield b"".join(chunk)
+
+
+async def fetch_xml(url: str, client: httpx.AsyncClient) -> bytes:
+    """Verilen URL'den XML içeriğini paylaşılan client ile çeker."""
+    try:
+        resp = await client.get(url)
+    except httpx.RequestError as e:
+        logger.error("XML feed isteği başarısız: %s -> %s", url, e)
+        raise HTTPException(status_code=502, detail=f"Upstream feed erişilemedi: {url}")
     if resp.status_code != 200:
         logger.error("XML feed HTTP %s döndü: %s", resp.status_code, url)
         raise HTTPException(status_code=502, detail=f"Upstream feed HTTP {resp.status_code}: {url}")
@@ -229,10 +774,99 @@ async def fetch_xml(url: str) -> bytes:
     return resp.content
 
 
+# Birleşik feed cache'i: (store_url, supplier_url, key_field) -> (xml, rows, expires_at).
+# Kayıtlar eklenme sırasıyla durur; dolunca en eski kayıt atılır.
+_MERGE_CACHE: dict[tuple[str, str, str], tuple[bytes, list[MergedRow], float]] = {}
+# Anahtar başına lock ve onu kullanan (bekleyen dahil) istek sayısı; sayı 0'a inince lock silinir
+_MERGE_LOCKS: dict[tuple[str, str, str], tuple[asyncio.Lock, int]] = {}
+
+
+def _purge_merge_cache(now: float) -> None:
+    """Süresi dolmuş cache kayıtlarını temizle."""
+    for cache_key in [k for k, entry in _MERGE_CACHE.items() if entry[2] <= now]:
+        del _MERGE_CACHE[cache_key]
+
+
+def _store_merge_cache(cache_key: tuple[str, str, str], entry: tuple[bytes, list[MergedRow], float]) -> None:
+    """Kaydı cache'e yaz; MERGE_CACHE_MAX_ENTRIES aşılırsa en eski kayıtları at."""
+    _purge_merge_cache(time.monotonic())
+    # Tazelenen kayıt sona taşınsın diye önce silinir
+    _MERGE_CACHE.pop(cache_key, None)
+    while _MERGE_CACHE and len(_MERGE_CACHE) >= MERGE_CACHE_MAX_ENTRIES:
+        del _MERGE_CACHE[next(iter(_MERGE_CACHE))]
+    if MERGE_CACHE_MAX_ENTRIES > 0:
+        _MERGE_CACHE[cache_key] = entry
+
+
+async def get_merged_cached(
+    store_url: str,
+    supplier_url: str,
+    key_field: str,
+    client: httpx.AsyncClient,
+    ttl: float = MERGE_CACHE_TTL,
+    use_cache: bool = True,
+) -> tuple[bytes, list[MergedRow]]:
+    """
+    Feed'leri çekip birleştirir; sonucu ttl saniye boyunca cache'te tutar.
+
+    Aynı anahtar için eş zamanlı gelen istekler tek bir merge'ü bekler.
+    use_cache=False ise cache okunmaz, feed'ler yeniden çekilir ve cache tazelenir.
+    Lock'lar sadece istek sürdüğü sürece tutulur; fetch / merge hata verse de silinir.
+    """
+    cache_key = (store_url, supplier_url, key_field)
+
+    if use_cache:
+        entry = _MERGE_CACHE.get(cache_key)
+        if entry is not None and entry[2] > time.monotonic():
+            return entry[0], entry[1]
+
+    lock, users = _MERGE_LOCKS.get(cache_key, (None, 0))
+    if lock is None:
+        lock = asyncio.Lock()
+    _MERGE_LOCKS[cache_key] = (lock, users + 1)
+
+    try:
+        async with lock:
+            if use_cache:
+                # Lock beklenirken başka bir istek cache'i doldurmuş olabilir
+                entry = _MERGE_CACHE.get(cache_key)
+                if entry is not None and entry[2] > time.monotonic():
+                    return entry[0], entry[1]
+
+            store_xml, supplier_xml = await asyncio.gather(
+                fetch_xml(store_url, client),
+                fetch_xml(supplier_url, client),
+            )
+            # CPU-yoğun merge event loop'u bloklamasın diye thread'de çalışır
+            merged_xml, merged_rows = await asyncio.to_thread(
+                compute_merged,
+                store_xml=store_xml,
+                supplier_xml=supplier_xml,
+                key_field=key_field,
+            )
+
+            _store_merge_cache(cache_key, (merged_xml, merged_rows, time.monotonic() + ttl))
+    finally:
+        lock, users = _MERGE_LOCKS[cache_key]
+        if users == 1:
+            del _MERGE_LOCKS[cache_key]
+        else:
+            _MERGE_LOCKS[cache_key] = (lock, users - 1)
+
+    return merged_xml, merged_rows
+
+
 # ---------------------------------------------------
 # API endpoint'leri
 # ---------------------------------------------------
 
+# Endpoint'lerde ortak kullanılan query parametreleri (tek tanım, tek validator)
+KeyField = Annotated[str, Query(pattern="^(barkod|stokKodu)$", description="Ürün eşleştirme alanı")]
+StoreUrlOverride = Annotated[str | None, Query(description="Mağaza feed URL override")]
+SupplierUrlOverride = Annotated[str | None, Query(description="Tedarikçi feed URL override")]
+UseCache = Annotated[bool, Query(description="False ise cache atlanır, feed'ler yeniden çekilir")]
+
+
 @app.get("/", summary="Servis durumu")
 async def root():
     return {
@@ -283,11 +917,13 @@ async def root():
     response_class=Response,
 )
 async def get_merged_products_xml(
+    request: Request,
     token: str = Query(..., description="Basit güvenlik için API token"),
-    key_field: str = Query("barkod", regex="^(barkod|stokKodu)$", description="Ürün eşleştirme alanı"),
+    key_field: KeyField = "barkod",
     download: bool = Query(False, description="True ise dosya indirme davranışı tetiklenir"),
-    store_url: str | None = Query(None, description="Mağaza feed URL override"),
-    supplier_url: str | None = Query(None, description="Tedarikçi feed URL override"),
+    store_url: StoreUrlOverride = None,
+    supplier_url: SupplierUrlOverride = None,
+    cache: UseCache = True,
 ):
     if token != API_TOKEN:
         raise HTTPException(status_code=403, detail="Geçersiz token")
@@ -300,11 +936,16 @@ async def get_merged_products_xml(
     except ValueError as exc:
         raise HTTPException(status_code=500, detail=str(exc))
 
-    store_xml = await fetch_xml(resolved_store_url)
-    supplier_xml = await fetch_xml(resolved_supplier_url)
-
     try:
-        merged_xml, _ = compute_merged(store_xml=store_xml, supplier_xml=supplier_xml, key_field=key_field)
+        merged_xml, _ = await get_merged_cached(
+            resolved_store_url,
+            resolved_supplier_url,
+            key_field,
+            request.app.state.http,
+            use_cache=cache,
+        )
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
@@ -320,7 +961,7 @@ async def get_merged_products_xml(
 
 @app.get("/health", summary="Health check")
 async def health():
-    return JSONResponse({"status": "ok"})
+    return ORJSONResponse({"status": "ok"})
 
 #CSV endpoint
 @app.get(
@@ -329,10 +970,12 @@ async def health():
     response_class=Response,
 )
 async def get_merged_products_csv(
+    request: Request,
     token: str = Query(..., description="Basit güvenlik için API token"),
-    key_field: str = Query("barkod", regex="^(barkod|stokKodu)$", description="Ürün eşleştirme alanı"),
-    store_url: str | None = Query(None, description="Mağaza feed URL override"),
-    supplier_url: str | None = Query(None, description="Tedarikçi feed URL override"),
+    key_field: KeyField = "barkod",
+    store_url: StoreUrlOverride = None,
+    supplier_url: SupplierUrlOverride = None,
+    cache: UseCache = True,
 ):
     if token != API_TOKEN:
         raise HTTPException(status_code=403, detail="Geçersiz token")
@@ -345,46 +988,40 @@ async def get_merged_products_csv(
     except ValueError as exc:
         raise HTTPException(status_code=500, detail=str(exc))
 
-    # XML feed'leri çek
-    store_xml = await fetch_xml(resolved_store_url)
-    supplier_xml = await fetch_xml(resolved_supplier_url)
-
-    # Merge + satırları çıkar
     try:
-        _, merged_rows = compute_merged(
-            store_xml=store_xml,
-            supplier_xml=supplier_xml,
-            key_field=key_field,
-        )
+        if cache:
+            # Cache'teki satırlardan CSV üret
+            _, merged_rows = await get_merged_cached(
+                resolved_store_url,
+                resolved_supplier_url,
+                key_field,
+                request.app.state.http,
+            )
+        else:
+            # Cache yoksa satırlar generator olarak döner, CSV akış halinde gönderilir
+            store_xml, supplier_xml = await asyncio.gather(
+                fetch_xml(resolved_store_url, request.app.state.http),
+                fetch_xml(resolved_supplier_url, request.app.state.http),
+            )
+            merged_rows = await asyncio.to_thread(
+                iter_merged_rows,
+                store_xml=store_xml,
+                supplier_xml=supplier_xml,
+                key_field=key_field,
+            )
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         logger.exception("CSV üretimi sırasında hata")
         raise HTTPException(status_code=500, detail=f"CSV üretimi sırasında hata: {e}")
 
-    # CSV üret
-    output = StringIO()
-    # writer = csv.writer(output, delimiter=";")
-    writer = csv.writer(output, delimiter=",", quoting=csv.QUOTE_MINIMAL)
-    writer.writerow(["Barkod", "Key", "Ürün Adı", "Mağaza Stok", "Tedarikçi Stok", "Toplam Stok"])
-
-    for r in merged_rows:
-        writer.writerow([
-            r["barkod"],
-            r["key"],
-            r["urunAdi"],
-            r["stok_magaza"],
-            r["stok_tedarikci"],
-            r["stok_toplam"],
-        ])
-
-    csv_bytes = output.getvalue().encode("utf-8-sig")  # Excel için BOM
-
     headers = {
         "Content-Disposition": 'attachment; filename="birlesik_stok.csv"'
     }
 
-    return Response(content=csv_bytes, media_type="text/csv", headers=headers)
+    return StreamingResponse(csv_stream_generator(merged_rows), media_type="text/csv", headers=headers)
 
 
 # ---------------------------------------------------
@@ -395,9 +1032,10 @@ async def get_merged_products_csv(
 async def ui(
     request: Request,
     run: bool = Query(False, description="True ise anlık merge yap ve sonucu göster"),
-    key_field: str = Query("barkod", regex="^(barkod|stokKodu)$"),
-    store_url: str | None = Query(None, description="Mağaza feed URL override"),
-    supplier_url: str | None = Query(None, description="Tedarikçi feed URL override"),
+    key_field: KeyField = "barkod",
+    store_url: StoreUrlOverride = None,
+    supplier_url: SupplierUrlOverride = None,
+    cache: UseCache = True,
 ):
     """
     İnsan gözüyle test etmeye yarayan şık UI.
@@ -414,9 +1052,13 @@ async def ui(
     if run:
         try:
             resolved_store_url, resolved_supplier_url = resolve_feed_urls(store_override, supplier_override)
-            store_xml = await fetch_xml(resolved_store_url)
-            supplier_xml = await fetch_xml(resolved_supplier_url)
-            _, merged_rows = compute_merged(store_xml=store_xml, supplier_xml=supplier_xml, key_field=key_field)
+            _, merged_rows = await get_merged_cached(
+                resolved_store_url,
+                resolved_supplier_url,
+                key_field,
+                request.app.state.http,
+                use_cache=cache,
+            )
         except ValueError as e:
             error = str(e)
         except HTTPException as e:
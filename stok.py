@@ -7,11 +7,15 @@ from flask import (
     url_for,
     flash,
 )
-import xml.etree.ElementTree as ET
+from lxml import etree as ET
 from decimal import Decimal, InvalidOperation
 from io import BytesIO, StringIO
+from typing import NamedTuple
 import logging
 import csv
+import sys
+import gzip
+import operator
 
 app = Flask(__name__)
 app.secret_key = "CHANGE_ME_TO_SOMETHING_RANDOM"  # flash mesajları için
@@ -20,18 +24,39 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def parse_decimal(text: str) -> Decimal:
-    """Stok için güvenli decimal parse. Hatalıysa 0 döner."""
+def parse_decimal(text: str) -> int | Decimal:
+    """Stok için güvenli parse. Düz rakamlar int, diğerleri Decimal. Hatalıysa 0 döner."""
     if text is None:
-        return Decimal(0)
+        return 0
     text = text.strip()
     if not text:
-        return Decimal(0)
+        return 0
+    if text.isascii() and text.isdigit():
+        return int(text)
     try:
         return Decimal(text.replace(",", "."))
     except (InvalidOperation, ValueError):
         logger.warning("Sayısal olmayan stok değeri tespit edildi: %r, 0 kabul ediliyor", text)
-        return Decimal(0)
+        return 0
+
+
+def is_integral(value: Decimal) -> bool:
+    """Decimal tam sayı mı? Üs >= 0 ise (örn. '12') yeni Decimal üretmeden karar verilir."""
+    return value.as_tuple().exponent >= 0 or value == value.to_integral_value()
+
+
+def format_stok(value: int | Decimal) -> str:
+    """XML'e yazılacak stok metni: tam sayıysa integer, değilse decimal string."""
+    if isinstance(value, int):
+        return str(value)
+    return str(int(value)) if is_integral(value) else format(value, "f")
+
+
+def stok_for_row(value: int | Decimal) -> int | float:
+    """UI / CSV satırı için stoğu int'e (tam sayıysa) veya float'a çevir."""
+    if isinstance(value, int):
+        return value
+    return int(value) if is_integral(value) else float(value)
 
 
 def load_products(xml_bytes: bytes, key_field: str):
@@ -40,10 +65,13 @@ def load_products(xml_bytes: bytes, key_field: str):
     key_field: 'barkod' veya 'stokKodu'
     Dönen:
         root: ET.Element
-        products: { key: {"urun": element, "stok": Decimal} }
+        products: { key: (urun, stok, stok_el, barkod_el, urun_adi_el) }
     """
     try:
-        root = ET.fromstring(xml_bytes)
+        # Yüklenen dosyalarda sadece belge içi entity'ler çözülür (XXE'ye karşı).
+        # Parser her çağrıda oluşturulur: Flask thread'li çalışıyor ve paylaşılan
+        # bir lxml parser'ı thread'ler arasında kilitlenir.
+        root = ET.fromstring(xml_bytes, ET.XMLParser(resolve_entities="internal"))
     except ET.ParseError:
         raise ValueError("Geçersiz XML formatı")
 
@@ -53,24 +81,88 @@ def load_products(xml_bytes: bytes, key_field: str):
     products = {}
 
     for urun in root.findall("urun"):
-        key_el = urun.find(key_field)
+        # Alt elemanları tek geçişte topla (her alan için ayrı find() yerine)
+        key_el = stok_el = barkod_el = urun_adi_el = None
+        for child in urun:
+            tag = child.tag
+            if tag == key_field and key_el is None:
+                key_el = child
+            if tag == "stok":
+                if stok_el is None:
+                    stok_el = child
+            elif tag == "barkod":
+                if barkod_el is None:
+                    barkod_el = child
+            elif tag == "urunAdi":
+                if urun_adi_el is None:
+                    urun_adi_el = child
+
         if key_el is None or key_el.text is None or not key_el.text.strip():
             # key olmayanları atlıyoruz
             continue
 
-        key = key_el.text.strip()  # baş/son boşlukları temizle
+        # baş/son boşlukları temizle; intern ile tedarikçi map'iyle aynı nesne paylaşılır
+        key = sys.intern(key_el.text.strip())
 
-        stok_el = urun.find("stok")
         stok = parse_decimal(stok_el.text if stok_el is not None else None)
 
-        products[key] = {
-            "urun": urun,
-            "stok": stok,
-        }
+        products[key] = (urun, stok, stok_el, barkod_el, urun_adi_el)
 
     return root, products
 
 
+def load_supplier_stocks(xml_bytes: bytes, key_field: str) -> dict[str, str | None]:
+    """
+    Tedarikçi XML'inden sadece stokları mapler, ağaç tutulmaz.
+    XML iterparse ile okunur, her <urun> işlendikten sonra temizlenir.
+    Dönen:
+        { key: ham <stok> metni } (parse_decimal merge sırasında çağrılır)
+    """
+    context = ET.iterparse(BytesIO(xml_bytes), events=("end",), tag="urun", resolve_entities="internal")
+    stocks = {}
+
+    # Sadece metin lazım: findtext Element nesnesi döndürmez, erişimciler bir kez bağlanır
+    find_key = operator.methodcaller("findtext", key_field)
+    find_stok = operator.methodcaller("findtext", "stok")
+
+    try:
+        for _, urun in context:
+            # tag="urun" her derinlikte eşleşir; mağaza tarafındaki gibi sadece root'un
+            # doğrudan çocukları sayılır (örn. <grup> içindeki <urun>'lar atlanır).
+            # İç içe olanlar temizlenmez: üst elemanları root seviyesinde silinir.
+            parent = urun.getparent()
+            if parent is None or parent.getparent() is not None:
+                continue
+
+            key = find_key(urun)
+            if key is not None and key.strip():
+                # Ham metin tutulur; sadece mağazada eşleşen ürünler parse edilir
+                stocks[sys.intern(key.strip())] = find_stok(urun)
+
+            # işlenen ürünü ve önceki kardeşlerini bellekten at
+            urun.clear()
+            while urun.getprevious() is not None:
+                del urun.getparent()[0]
+    except ET.ParseError:
+        raise ValueError("Geçersiz XML formatı")
+
+    if context.root is None or context.root.tag != "urunler":
+        raise ValueError("Root elemanı 'urunler' olmalı")
+
+    return stocks
+
+
+class MergedRow(NamedTuple):
+    """UI / CSV için ürün bazlı özet satırı."""
+
+    key: str
+    barkod: str
+    urunAdi: str
+    stok_magaza: int | float
+    stok_tedarikci: int | float
+    stok_toplam: int | float
+
+
 def merge_xml_feeds(store_xml: bytes, supplier_xml: bytes, key_field: str = "barkod"):
     """
     İki XML feed'ini birleştirir.
@@ -83,52 +175,41 @@ def merge_xml_feeds(store_xml: bytes, supplier_xml: bytes, key_field: str = "bar
         raise ValueError("key_field sadece 'barkod' veya 'stokKodu' olabilir")
 
     store_root, store_products = load_products(store_xml, key_field)
-    _, supplier_products = load_products(supplier_xml, key_field)
+    supplier_stocks = load_supplier_stocks(supplier_xml, key_field)
 
     merged_rows = []  # UI / CSV için kullanılacak
 
     for key, sdata in store_products.items():
-        urun_node = sdata["urun"]
-        stok_magaza = sdata["stok"]
+        urun_node, stok_magaza, stok_el, barkod_el, urun_adi_el = sdata
 
-        if key in supplier_products:
-            stok_tedarikci = supplier_products[key]["stok"]
-        else:
-            stok_tedarikci = Decimal(0)
+        stok_tedarikci = parse_decimal(supplier_stocks.get(key))
 
         stok_toplam = stok_magaza + stok_tedarikci
 
         # Negatif olursa 0'a çek (teoride gerekmez ama tedbir)
         if stok_toplam < 0:
-            stok_toplam = Decimal(0)
+            stok_toplam = 0
 
-        # <stok> elementini bul ve toplam stok ile güncelle
-        stok_el = urun_node.find("stok")
+        # <stok> elementini toplam stok ile güncelle (yoksa ekle)
         if stok_el is None:
             stok_el = ET.SubElement(urun_node, "stok")
 
-        # Tam sayı ise integer yaz, yoksa decimal string
-        if stok_toplam == stok_toplam.to_integral_value():
-            stok_el.text = str(int(stok_toplam))
-        else:
-            stok_el.text = format(stok_toplam, "f")
+        stok_el.text = format_stok(stok_toplam)
 
         # UI / CSV için satır ekle
-        barkod_el = urun_node.find("barkod")
-        urun_adi_el = urun_node.find("urunAdi")
         merged_rows.append(
-            {
-                "key": key,
-                "barkod": barkod_el.text.strip() if barkod_el is not None and barkod_el.text else "",
-                "urunAdi": urun_adi_el.text.strip() if urun_adi_el is not None and urun_adi_el.text else "",
-                "stok_magaza": int(stok_magaza) if stok_magaza == stok_magaza.to_integral_value() else float(stok_magaza),
-                "stok_tedarikci": int(stok_tedarikci) if stok_tedarikci == stok_tedarikci.to_integral_value() else float(stok_tedarikci),
-                "stok_toplam": int(stok_toplam) if stok_toplam == stok_toplam.to_integral_value() else float(stok_toplam),
-            }
+            MergedRow(
+                key,
+                barkod_el.text.strip() if barkod_el is not None and barkod_el.text else "",
+                urun_adi_el.text.strip() if urun_adi_el is not None and urun_adi_el.text else "",
+                stok_for_row(stok_magaza),
+                stok_for_row(stok_tedarikci),
+                stok_for_row(stok_toplam),
+            )
         )
 
     # Çıktı XML'ini bytes olarak üret
-    merged_xml_bytes = ET.tostring(store_root, encoding="utf-8", xml_declaration=True)
+    merged_xml_bytes = ET.tostring(store_root, encoding="utf-8", xml_declaration=True, pretty_print=False)
 
     return merged_xml_bytes, merged_rows
 
@@ -228,6 +309,12 @@ INDEX_TEMPLATE = """
           </tbody>
         </table>
       </div>
+      {% if total_count > merged_rows|length %}
+      <div class="p-3 text-center text-muted small">
+        İlk {{ merged_rows|length }} ürün gösteriliyor, toplam {{ total_count }} ürün var.
+        Tam liste XML / CSV çıktısında.
+      </div>
+      {% endif %}
     </div>
   </div>
   {% endif %}
@@ -236,14 +323,63 @@ INDEX_TEMPLATE = """
 </html>
 """
 
-# Bellekte tutulan son birleşik XML ve satırlar (demo için)
+# Bellekte tutulan son birleşik XML / CSV (gzip'li) ve önizleme satırları (demo için)
 MERGED_XML_CACHE = {}
 
+# Sayfada gösterilecek maksimum satır; tam liste XML / CSV çıktısında
+PREVIEW_ROWS = 100
+
+
+def build_csv_bytes(rows) -> bytes:
+    """Birleşik satırlardan Excel uyumlu (BOM'lu UTF-8, ';' ayraçlı) CSV üret."""
+    output = StringIO()
+    writer = csv.writer(output, delimiter=";")
+    writer.writerow(["Barkod", "Key", "Ürün Adı", "Mağaza Stok", "Tedarikçi Stok", "Toplam Stok"])
+    for r in rows:
+        writer.writerow(
+            [
+                r.barkod,
+                r.key,
+                r.urunAdi,
+                r.stok_magaza,
+                r.stok_tedarikci,
+                r.stok_toplam,
+            ]
+        )
+
+    return output.getvalue().encode("utf-8-sig")  # Excel için BOM'lu UTF-8
+
+
+def send_gzipped(gz_bytes: bytes, mimetype: str, download_name: str):
+    """
+    Cache'teki gzip'li içeriği gönder. Tarayıcı gzip kabul ediyorsa olduğu gibi
+    (Content-Encoding: gzip), etmiyorsa açılarak gönderilir.
+    """
+    # "in" gzip;q=0 için de True döner; [] ise kalite değerini (yoksa 0) verir
+    if request.accept_encodings["gzip"] > 0:
+        response = send_file(
+            BytesIO(gz_bytes),
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=download_name,
+        )
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = send_file(
+            BytesIO(gzip.decompress(gz_bytes)),
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=download_name,
+        )
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
 
 @app.route("/", methods=["GET"])
 def index():
-    merged_rows = MERGED_XML_CACHE.get("rows")
-    return render_template_string(INDEX_TEMPLATE, merged_rows=merged_rows)
+    merged_rows = MERGED_XML_CACHE.get("preview")
+    total_count = MERGED_XML_CACHE.get("total", 0)
+    return render_template_string(INDEX_TEMPLATE, merged_rows=merged_rows, total_count=total_count)
 
 
 @app.route("/merge", methods=["POST"])
@@ -277,9 +413,12 @@ def merge():
         flash(f"Beklenmeyen bir hata oluştu: {e}")
         return redirect(url_for("index"))
 
-    # Belleğe yaz (demo için)
-    MERGED_XML_CACHE["data"] = merged_xml_bytes
-    MERGED_XML_CACHE["rows"] = merged_rows
+    # Belleğe yaz (demo için). XML ve CSV gzip'li tutulur (10-20x küçülür);
+    # satır listesinin tamamı yerine sadece sayfada gösterilecek kısmı saklanır.
+    MERGED_XML_CACHE["data"] = gzip.compress(merged_xml_bytes, compresslevel=1)
+    MERGED_XML_CACHE["csv"] = gzip.compress(build_csv_bytes(merged_rows), compresslevel=1)
+    MERGED_XML_CACHE["preview"] = merged_rows[:PREVIEW_ROWS]
+    MERGED_XML_CACHE["total"] = len(merged_rows)
 
     flash("Stoklar başarıyla birleştirildi.")
     return redirect(url_for("index"))
@@ -287,49 +426,22 @@ def merge():
 
 @app.route("/download-merged", methods=["GET"])
 def download_merged():
-    xml_bytes = MERGED_XML_CACHE.get("data")
-    if not xml_bytes:
+    xml_gz = MERGED_XML_CACHE.get("data")
+    if not xml_gz:
         flash("Önce stokları birleştirmeniz gerekiyor.")
         return redirect(url_for("index"))
 
-    return send_file(
-        BytesIO(xml_bytes),
-        mimetype="application/xml",
-        as_attachment=True,
-        download_name="birlesik_stok.xml",
-    )
+    return send_gzipped(xml_gz, "application/xml", "birlesik_stok.xml")
 
 
 @app.route("/download-merged-csv", methods=["GET"])
 def download_merged_csv():
-    rows = MERGED_XML_CACHE.get("rows")
-    if not rows:
+    csv_gz = MERGED_XML_CACHE.get("csv")
+    if not csv_gz:
         flash("Önce stokları birleştirmeniz gerekiyor.")
         return redirect(url_for("index"))
 
-    output = StringIO()
-    writer = csv.writer(output, delimiter=";")
-    writer.writerow(["Barkod", "Key", "Ürün Adı", "Mağaza Stok", "Tedarikçi Stok", "Toplam Stok"])
-    for r in rows:
-        writer.writerow(
-            [
-                r["barkod"],
-                r["key"],
-                r["urunAdi"],
-                r["stok_magaza"],
-                r["stok_tedarikci"],
-                r["stok_toplam"],
-            ]
-        )
-
-    csv_bytes = output.getvalue().encode("utf-8-sig")  # Excel için BOM'lu UTF-8
-
-    return send_file(
-        BytesIO(csv_bytes),
-        mimetype="text/csv",
-        as_attachment=True,
-        download_name="birlesik_stok.csv",
-    )
+    return send_gzipped(csv_gz, "text/csv", "birlesik_stok.csv")
 
 
 if __name__ == "__main__":
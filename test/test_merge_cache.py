@@ -0,0 +1,94 @@
+"""
+get_merged_cached'in lock / cache davranışını kontrol eder (fetch_xml stub'lanır).
+
+Repo kökünden çalıştırılır: python -m unittest discover -s test
+"""
+
+import asyncio
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from fastapi import HTTPException
+
+import app
+
+TEST_DIR = Path(__file__).parent
+FEEDS = {
+    "magaza": (TEST_DIR / "magaza.xml").read_bytes(),
+    "tedarikci": (TEST_DIR / "tedarikci.xml").read_bytes(),
+}
+
+
+class MergeCacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        app._MERGE_CACHE.clear()
+        app._MERGE_LOCKS.clear()
+        self.fetched = []
+        patcher = mock.patch.object(app, "fetch_xml", self.fake_fetch_xml)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def fake_fetch_xml(self, url, client):
+        self.fetched.append(url)
+        await asyncio.sleep(0.01)  # Eş zamanlı istekler lock'ta beklesin
+        if url not in FEEDS:
+            raise HTTPException(status_code=502, detail=f"Upstream feed erişilemedi: {url}")
+        return FEEDS[url]
+
+    async def test_concurrent_requests_fetch_once(self):
+        results = await asyncio.gather(
+            *(app.get_merged_cached("magaza", "tedarikci", "barkod", None) for _ in range(5))
+        )
+
+        self.assertEqual(sorted(self.fetched), ["magaza", "tedarikci"])
+        self.assertTrue(all(result == results[0] for result in results))
+        self.assertEqual(app._MERGE_LOCKS, {})
+
+    async def test_lock_removed_after_failed_fetch(self):
+        for _ in range(3):
+            with self.assertRaises(HTTPException):
+                await app.get_merged_cached("yok", "tedarikci", "barkod", None)
+
+        results = await asyncio.gather(
+            *(app.get_merged_cached("yok", "tedarikci", "barkod", None) for _ in range(3)),
+            return_exceptions=True,
+        )
+
+        self.assertTrue(all(isinstance(result, HTTPException) for result in results))
+        self.assertEqual(app._MERGE_LOCKS, {})
+        self.assertEqual(app._MERGE_CACHE, {})
+
+    async def test_cache_false_refreshes_entry(self):
+        await app.get_merged_cached("magaza", "tedarikci", "barkod", None)
+        _, _, expires_at = app._MERGE_CACHE[("magaza", "tedarikci", "barkod")]
+
+        await app.get_merged_cached("magaza", "tedarikci", "barkod", None)
+        self.assertEqual(len(self.fetched), 2)  # Cache'ten döndü
+
+        await app.get_merged_cached("magaza", "tedarikci", "barkod", None, use_cache=False)
+        self.assertEqual(len(self.fetched), 4)
+        self.assertGreater(app._MERGE_CACHE[("magaza", "tedarikci", "barkod")][2], expires_at)
+
+    async def test_oldest_entry_evicted_at_max_entries(self):
+        keys = [
+            ("magaza", "tedarikci", "barkod"),
+            ("magaza", "tedarikci", "stokKodu"),
+            ("tedarikci", "magaza", "barkod"),
+        ]
+
+        with mock.patch.object(app, "MERGE_CACHE_MAX_ENTRIES", 2):
+            for key in keys:
+                await app.get_merged_cached(*key, None)
+
+            self.assertEqual(list(app._MERGE_CACHE), keys[1:])
+
+            # Tazelenen kayıt sona taşınır, bir sonraki eklemede en eski olan atılır
+            await app.get_merged_cached(*keys[1], None, use_cache=False)
+            await app.get_merged_cached(*keys[0], None)
+
+        self.assertEqual(list(app._MERGE_CACHE), [keys[1], keys[0]])
+
+
+if __name__ == "__main__":
+    unittest.main()
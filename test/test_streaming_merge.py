@@ -0,0 +1,95 @@
+"""
+STREAMING_XML_MERGE yolunun ağaç versiyonu (compute_merged) ile aynı sonucu verdiğini kontrol eder.
+
+Repo kökünden çalıştırılır: python -m unittest discover -s test
+"""
+
+import unittest
+from pathlib import Path
+
+import app
+
+TEST_DIR = Path(__file__).parent
+
+SUPPLIER = (
+    b"<urunler><urun><barkod>1</barkod><stok>5</stok></urun>"
+    b"<urun><barkod>2</barkod><stok>1,5</stok></urun></urunler>"
+)
+
+
+def _compute_merged_tree(store_xml: bytes, supplier_xml: bytes, key_field: str):
+    flag = app.STREAMING_XML_MERGE
+    app.STREAMING_XML_MERGE = False
+    try:
+        return app.compute_merged(store_xml, supplier_xml, key_field)
+    finally:
+        app.STREAMING_XML_MERGE = flag
+
+
+class StreamingMergeTest(unittest.TestCase):
+    def assertStreamingMatchesTree(self, store_xml: bytes, supplier_xml: bytes = SUPPLIER, key_field: str = "barkod"):
+        self.assertEqual(
+            app.compute_merged_streaming(store_xml, supplier_xml, key_field),
+            _compute_merged_tree(store_xml, supplier_xml, key_field),
+        )
+
+    def test_fixture_feeds(self):
+        store_xml = (TEST_DIR / "magaza.xml").read_bytes()
+        supplier_xml = (TEST_DIR / "tedarikci.xml").read_bytes()
+        for key_field in ("barkod", "stokKodu"):
+            with self.subTest(key_field=key_field):
+                self.assertStreamingMatchesTree(store_xml, supplier_xml, key_field)
+
+    def test_store_variants(self):
+        variants = {
+            "boş root": b"<urunler/>",
+            "stok yok": b"<urunler><urun><barkod>1</barkod><ad>a</ad>\n</urun></urunler>",
+            "root seviyesinde yorum / PI": (
+                b"<!--once--><urunler>\n<!-- a -->\n<urun><barkod>1</barkod><stok>1</stok></urun>\n"
+                b"<!-- b --><?pi x?> <urun><barkod>2</barkod><stok>2</stok></urun><!-- c -->\n</urunler><!--sonra-->"
+            ),
+            "sadece yorum": b"<urunler> <!-- a --> </urunler>",
+            "tekrarlanan key": (
+                b"<urunler><urun><barkod>1</barkod><stok>1</stok></urun>"
+                b"<urun><barkod>2</barkod><stok>7</stok></urun>"
+                b"<urun><barkod>1</barkod><stok>3</stok></urun></urunler>"
+            ),
+            "tekrarlanan key, farklı <stok> halleri": (
+                b'<urunler><urun><barkod>1</barkod><stok birim="a&amp;b">x &amp; y&#13;</stok></urun>'
+                b"<urun><barkod>1</barkod></urun><urun><barkod>1</barkod><stok/></urun>"
+                b"<urun><barkod>1</barkod><stok>4</stok></urun><urun><barkod>1</barkod><ad/></urun></urunler>"
+            ),
+            "namespace": (
+                b'<urunler xmlns:g="http://g"><urun><g:x/><barkod>1</barkod></urun>'
+                b'<urun><barkod>1</barkod><stok g:u="1">2</stok></urun><diger g:y="1"/></urunler>'
+            ),
+            "root namespace'ini tekrarlayan ürün": (
+                b'<urunler xmlns:g="http://g"><urun xmlns:g="http://g"><g:x/><barkod>1</barkod>'
+                b"<stok>1</stok></urun><urun><barkod>2</barkod></urun></urunler>"
+            ),
+            "<stok> içinde yorum": b"<urunler><urun><barkod>1</barkod><stok>1<!--c--></stok></urun></urunler>",
+            "<stok> içinde eleman": b"<urunler><urun><barkod>1</barkod><stok>1<x/>2</stok><ad/></urun></urunler>",
+            "tekrarlanan key, çocuklu <stok>": (
+                b"<urunler><urun><barkod>1</barkod><stok>1<x/>2</stok></urun>"
+                b"<urun><barkod>1</barkod><stok><!--c--></stok></urun>"
+                b"<urun><barkod>1</barkod><stok>3</stok></urun></urunler>"
+            ),
+            "placeholder metni başka alanda": (
+                "<urunler><urun><ad>" + app._STOK_PLACEHOLDER + "</ad><barkod>1</barkod>"
+                "<stok>1</stok></urun></urunler>"
+            ).encode("utf-8"),
+        }
+        for name, store_xml in variants.items():
+            with self.subTest(name):
+                self.assertStreamingMatchesTree(store_xml)
+
+    def test_internal_entity(self):
+        store_xml = b'<!DOCTYPE urunler [<!ENTITY e "4">]><urunler><urun><barkod>1</barkod><stok>&e;</stok></urun></urunler>'
+        self.assertStreamingMatchesTree(store_xml)
+        merged_xml, rows = app.compute_merged_streaming(store_xml, SUPPLIER, "barkod")
+        self.assertEqual((rows[0].stok_magaza, rows[0].stok_toplam), (4, 9))
+        self.assertIn(b"<stok>9</stok>", merged_xml)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+"""
+SUPPLIER_REGEX_SCAN hızlı yolunun XML parser ile aynı sonucu verdiğini kontrol eder.
+
+Repo kökünden çalıştırılır: python -m unittest discover -s test
+"""
+
+import unittest
+from pathlib import Path
+
+import app
+
+TEST_DIR = Path(__file__).parent
+
+
+def _feed(*urunler: str, head: str = "") -> bytes:
+    return (head + "<urunler>" + "".join(urunler) + "</urunler>").encode("utf-8")
+
+
+class SupplierScanTest(unittest.TestCase):
+    def assertScanMatchesParser(self, xml_bytes: bytes, key_field: str = "barkod"):
+        scanned = app._scan_supplier_stocks(xml_bytes, key_field)
+        self.assertIsNotNone(scanned)
+        self.assertEqual(scanned, app.load_supplier_stocks(xml_bytes, key_field))
+
+    def test_fixture_feed(self):
+        xml_bytes = (TEST_DIR / "tedarikci.xml").read_bytes()
+        for key_field in ("barkod", "stokKodu"):
+            with self.subTest(key_field=key_field):
+                self.assertScanMatchesParser(xml_bytes, key_field)
+
+    def test_flat_feed_variants(self):
+        variants = {
+            "basit": _feed("<urun><barkod>1</barkod><stok>5</stok></urun>"),
+            "xml bildirimi": _feed(
+                "<urun><barkod>1</barkod><stok>5</stok></urun>",
+                head='<?xml version="1.0" encoding="UTF-8"?>\n',
+            ),
+            "urun kapanışında boşluk": _feed("<urun><barkod>1</barkod><stok>5</stok></urun >"),
+            "alan kapanışında boşluk": _feed("<urun><barkod >1</barkod\n><stok>5</stok \t></urun>"),
+            "attribute": _feed('<urun id="7"><barkod tip="ean">1</barkod><stok birim="adet">5</stok></urun>'),
+            "stok yok": _feed("<urun><barkod>1</barkod></urun>"),
+            "boş stok": _feed("<urun><barkod>1</barkod><stok></stok></urun>"),
+            "boş key": _feed("<urun><barkod> </barkod><stok>5</stok></urun>"),
+            "tekrarlanan key": _feed(
+                "<urun><barkod>1</barkod><stok>5</stok></urun>",
+                "<urun><barkod>1</barkod><stok>9</stok></urun>",
+            ),
+            "ilk değer geçerli": _feed("<urun><barkod>1</barkod><stok>5</stok><stok>9</stok><barkod>2</barkod></urun>"),
+            "key boşlukları": _feed("<urun>\n  <barkod>\n    1\n  </barkod>\n  <stok> 5 </stok>\n</urun>"),
+            "xml entity'leri": _feed(
+                "<urun><barkod>A&amp;B&lt;&gt;&quot;&apos;</barkod><stok>&#53;&#x30;</stok></urun>"
+            ),
+            "utf-8": _feed("<urun><barkod>Şç-1</barkod><stok>3</stok></urun>"),
+            "kendiliğinden kapanan alanlar": _feed(
+                '<urun><barkod>1</barkod><stok birim="adet"/></urun><urun><barkod/><stok>5</stok></urun>'
+            ),
+            "yorum içindeki alanlar": _feed(
+                "<urun><!-- <barkod>1</barkod><stok>99</stok> --><barkod>1</barkod><stok>5</stok></urun>"
+            ),
+            "CDATA içindeki alanlar": _feed(
+                "<urun><barkod>1</barkod><aciklama><![CDATA[<stok>99</stok> ]] ]]></aciklama><stok>5</stok></urun>"
+            ),
+            "ürünler arasında yorum": _feed(
+                "<!-- a --><urun><barkod>1</barkod><stok>5</stok></urun>\n<!-- b -->\n",
+                "<urun><barkod>2</barkod><stok>6</stok></urun><!-- c -->",
+            ),
+        }
+        for name, xml_bytes in variants.items():
+            with self.subTest(name):
+                self.assertScanMatchesParser(xml_bytes)
+
+        with self.subTest("stokKodu"):
+            self.assertScanMatchesParser(
+                _feed("<urun><stokKodu>OE-1</stokKodu><barkod>1</barkod><stok>2</stok></urun >"),
+                "stokKodu",
+            )
+
+    def test_falls_back_to_parser(self):
+        variants = {
+            "html entity": _feed("<urun><barkod>1&nbsp;</barkod><stok>5</stok></urun>"),
+            "çıplak &": _feed("<urun><barkod>A & B</barkod><stok>5</stok></urun>"),
+            "geçersiz karakter referansı": _feed("<urun><barkod>1</barkod><stok>&#0;</stok></urun>"),
+            "farklı root": b"<products><urun><barkod>1</barkod><stok>5</stok></urun></products>",
+            "utf-8 dışı encoding": _feed(
+                "<urun><barkod>1</barkod><stok>5</stok></urun>",
+                head='<?xml version="1.0" encoding="ISO-8859-9"?>',
+            ),
+            "CDATA key": _feed("<urun><barkod><![CDATA[1]]></barkod><stok>5</stok></urun>"),
+            "CDATA stok": _feed("<urun><barkod>1</barkod><stok><![CDATA[5]]></stok></urun>"),
+            "stok içinde yorum": _feed("<urun><barkod>1</barkod><stok>5<!-- c --></stok></urun>"),
+            "stok içinde eleman": _feed("<urun><barkod>1</barkod><stok>5<x/></stok></urun>"),
+            "grup içinde ürün": _feed("<grup><urun><barkod>1</barkod><stok>7</stok></urun></grup>"),
+            "grup sonra ürün": _feed(
+                "<urun><barkod>2</barkod><stok>3</stok></urun>",
+                "<grup><urun><barkod>1</barkod><stok>7</stok></urun></grup>",
+            ),
+            "iç içe ürün": _feed("<urun><barkod>2</barkod><urun><barkod>1</barkod><stok>7</stok></urun></urun>"),
+        }
+        for name, xml_bytes in variants.items():
+            with self.subTest(name):
+                self.assertIsNone(app._scan_supplier_stocks(xml_bytes, "barkod"))
+
+
+if __name__ == "__main__":
+    unittest.main()